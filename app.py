@@ -1,27 +1,137 @@
 import streamlit as st
-import pytesseract
 from PIL import Image
 import tempfile
-from pdf2image import convert_from_path, convert_from_bytes
-from openai import OpenAI
+import fitz  # PyMuPDF
+from openai import (
+    AsyncOpenAI, APITimeoutError, APIConnectionError, RateLimitError, InternalServerError,
+    AuthenticationError, PermissionDeniedError,
+)
+import httpx
+from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception_type
 import os
-import base64
+import time
+import asyncio
+import threading
+import weakref
+try:
+    import pybase64 as base64  # SIMD-accelerated drop-in for the stdlib module
+except ImportError:
+    import base64
 import io
+import html
+import mmap
+import shutil
+import hashlib
+import functools
+import diskcache
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Preformatted
 from reportlab.lib.styles import getSampleStyleSheet
+from ocr_worker import WorkerContext, ocr_page, preload
 
 # ===== Config =====
-# dev purposes
-# pytesseract.pytesseract.tesseract_cmd = "/opt/homebrew/bin/tesseract"
-# POPPLER_PATH = "/opt/homebrew/bin"
-
 # Initialize clients
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-groq_client = OpenAI(
-    api_key=os.getenv("GROQ_API_KEY"),
-    base_url="https://api.groq.com/openai/v1"
+# The SDK default is a 600s timeout with its own retries; we cap it and retry ourselves (see _create)
+API_TIMEOUT = httpx.Timeout(connect=5, read=90, write=30, pool=5)
+
+def _close_runtime(loop, http):
+    """Closes a dead session's HTTP pool and event loop.
+    Runs on its own thread: the garbage collector may fire this while another session's loop is running."""
+    def _close():
+        try:
+            loop.run_until_complete(http.aclose())
+        finally:
+            loop.close()
+    threading.Thread(target=_close, daemon=True).start()
+
+class SessionRuntime:
+    """Event loop + OpenAI/Groq clients sharing one keep-alive HTTP/2 pool, created once per session.
+    httpx pools are bound to the loop that opened them, so the loop lives across reruns
+    (instead of a fresh asyncio.run() per click) and sockets/TLS sessions get reused."""
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        http = httpx.AsyncClient(
+            http2=True,
+            timeout=API_TIMEOUT,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60)
+        )
+        self.openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http, timeout=API_TIMEOUT, max_retries=0)
+        self.groq_client = AsyncOpenAI(
+            api_key=os.getenv("GROQ_API_KEY"),
+            base_url="https://api.groq.com/openai/v1",
+            http_client=http,
+            timeout=API_TIMEOUT,
+            max_retries=0
+        )
+        # Streamlit drops session state when the session ends; the pool and loop go with it
+        weakref.finalize(self, _close_runtime, self.loop, http)
+
+if "runtime" not in st.session_state:
+    st.session_state.runtime = SessionRuntime()
+event_loop = st.session_state.runtime.loop
+openai_client = st.session_state.runtime.openai_client
+groq_client = st.session_state.runtime.groq_client
+
+def _failover(gpt, groq):
+    """[Primary, Fallback] order of a (Name, Client, Model, ...) pair, keyed by the selected primary."""
+    return {"GPT-4o": [gpt, groq], "Groq": [groq, gpt]}
+
+# Per-request image count and base64 payload caps of a vision model
+VisionCaps = namedtuple("VisionCaps", ["max_images", "max_payload"])
+
+# Built once per run instead of inside every helper call
+VISION_SEQUENCES = _failover(
+    ("GPT-4o", openai_client, "gpt-4o", VisionCaps(max_images=10, max_payload=20_000_000)),
+    # Groq rejects more than 5 images or ~4 MB of base64 per request; keep headroom for the prompt
+    ("Groq", groq_client, "meta-llama/llama-4-scout-17b-16e-instruct", VisionCaps(max_images=5, max_payload=3_500_000))
 )
+CATEGORY_SEQUENCES = _failover(("GPT-4o", openai_client, "gpt-4o-mini"), ("Groq", groq_client, "llama-3.1-8b-instant"))
+SUMMARY_SEQUENCES = _failover(("GPT-4o", openai_client, "gpt-4o"), ("Groq", groq_client, "llama-3.3-70b-versatile"))
+# Transient failures worth retrying; auth/bad-request errors fail fast to the fallback provider
+RETRYABLE_ERRORS = (APITimeoutError, APIConnectionError, RateLimitError, InternalServerError)
+# Key/billing problems won't heal in minutes, so they trip the breaker for much longer
+BILLING_ERRORS = (AuthenticationError, PermissionDeniedError)
+BILLING_COOLDOWN = 5 * 3600
+# Per-provider concurrent requests and tokens-per-minute budget, enforced per session (asyncio
+# primitives belong to the session's loop), so the account-wide load is this times active sessions
+PROVIDER_LIMITS = {
+    "api.openai.com": {"concurrency": 20, "tpm": 30000},
+    "api.groq.com": {"concurrency": 30, "tpm": 12000},
+}
+DEFAULT_LIMITS = {"concurrency": 10, "tpm": 10000}
+
+# Seconds to give the primary model before the fallback is fired alongside it
+HEDGE_DELAY = 3
+# Seconds between live re-renders of streamed text (each one re-sends the whole text to the browser)
+LIVE_RENDER_INTERVAL = 0.15
+# Categorization only looks at the start of the document
+CATEGORY_SAMPLE_CHARS = 1000
+# A PDF whose first pages carry more selectable text than this is treated as native (not scanned)
+TEXT_LAYER_MIN_CHARS = 200
+# Below this, a page's text layer is ignored and the page is OCR'd instead
+PAGE_TEXT_MIN_CHARS = 50
+# Marker the vision model separates consecutive pages with
+PAGE_DELIMITER = "<<<PAGE>>>"
+# Reports longer than this skip Paragraph markup parsing and are laid out as preformatted text
+LARGE_REPORT_CHARS = 50000
+# Tesseract processes for multi-page PDFs
+OCR_WORKERS = os.cpu_count() or 1
+# On-disk (L2) cache shared by every session; st.session_state is the in-memory L1
+CACHE_DIR = os.getenv("UCHIHA_CACHE_DIR", "/tmp/uchiha_cache")
+# Disk entries expire after this, so model or prompt changes eventually reach old documents
+CACHE_TTL = 7 * 24 * 3600
+
+@st.cache_resource
+def _ocr_pool():
+    # One pool per server; "spawn" avoids forking Streamlit's threads
+    return ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=WorkerContext(), initializer=preload)
+
+@st.cache_resource
+def _disk_cache():
+    return diskcache.Cache(CACHE_DIR)
 
 # --- Session State Management ---
 if "summary_result" not in st.session_state:
@@ -58,26 +168,375 @@ uploaded_file = st.file_uploader("Upload Document", type=["png", "jpg", "jpeg",
 def encode_image(image_bytes):
     return base64.b64encode(image_bytes).decode('utf-8')
 
-def get_routing_decision(file):
-    """AI Router: Analyzes visual complexity with automated GPT -> Groq fallback."""
+def _sha256(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+def _remove_file(path):
     try:
-        # Image Preparation
-        if file.type == "application/pdf":
-            images = convert_from_bytes(file.getvalue())
-            img = images[0]
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class Upload:
+    """Upload spooled to a temp file once, with the SHA-256 that keys every cache for this document.
+    The file is deleted by `cleanup()`, or at the latest when the session (and so this object) is dropped."""
+    def __init__(self, path, is_pdf, digest):
+        self.path = path
+        self.is_pdf = is_pdf
+        self.digest = digest
+        self.cleanup = weakref.finalize(self, _remove_file, path)
+
+def _sha256_file(path):
+    # mmap lets hashlib read the file straight from the page cache, with no Python bytes copy
+    if os.path.getsize(path) == 0:
+        return _sha256(b"")
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return hashlib.sha256(mm).hexdigest()
+
+def _read_upload(file):
+    """Streams the upload to a temp file and hashes it once per file, reusing the result across reruns.
+    The UploadedFile itself is already in memory; working from the file on disk (PyMuPDF mmaps it
+    by path) just keeps the pipeline from making further bytes copies of it."""
+    cached_upload = st.session_state.get("upload")
+    if st.session_state.get("upload_id") != file.file_id or cached_upload is None:
+        _discard_upload()
+        file.seek(0)
+        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.name)[1]) as tf:
+            shutil.copyfileobj(file, tf)
+        cached_upload = Upload(tf.name, file.type == "application/pdf", _sha256_file(tf.name))
+        st.session_state.upload, st.session_state.upload_id = cached_upload, file.file_id
+    return cached_upload
+
+def _discard_upload():
+    """Deletes the current upload's temp file (on replacement, or when the uploader is cleared)."""
+    cached_upload = st.session_state.pop("upload", None)
+    st.session_state.pop("upload_id", None)
+    if cached_upload is not None:
+        cached_upload.cleanup()
+
+class FailedResult(Exception):
+    """Raised by a cached helper that failed: `cached()` returns `fallback` to the caller but never stores it."""
+    def __init__(self, fallback):
+        super().__init__(fallback)
+        self.fallback = fallback
+
+class FallbackResult(FailedResult):
+    """Raised with an answer from the fallback provider: returned to the caller, but never stored
+    under the key of the primary that was asked for."""
+
+def cached(key_fn):
+    """Content-addressed memo for async helpers: session memory (L1) first, then disk (L2).
+    `key_fn` gets the helper's arguments and returns a tuple identifying the result."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            key = (fn.__name__, *key_fn(*args, **kwargs))
+            l1 = st.session_state.setdefault("result_cache", {})
+            if key in l1:
+                return l1[key]
+            value = _disk_cache().get(key)
+            if value is None:
+                try:
+                    value = await fn(*args, **kwargs)
+                except FailedResult as failure:
+                    return failure.fallback
+                _disk_cache().set(key, value, expire=CACHE_TTL)
+            l1[key] = value
+            return value
+        return wrapper
+    return decorator
+
+def _run_async(coro):
+    """Runs a coroutine to completion from the (synchronous) Streamlit script."""
+    try:
+        return event_loop.run_until_complete(coro)
+    finally:
+        # Like asyncio.run(): a Streamlit rerun/stop (a BaseException) can abort a gather mid-flight,
+        # so cancel whatever is left on the session loop instead of letting it resume on the next click
+        leftovers = asyncio.all_tasks(event_loop)
+        for task in leftovers:
+            task.cancel()
+        if leftovers:
+            event_loop.run_until_complete(asyncio.gather(*leftovers, return_exceptions=True))
+
+async def _race_providers(sequence, request, hedge_delay=HEDGE_DELAY):
+    """Hedged race: primary starts now, fallback after `hedge_delay` (or as soon as primary fails).
+    First successful response wins and the loser is cancelled.
+    Returns (index, result, primary_failed), with (None, None, True) if every provider failed."""
+    primary_failed = asyncio.Event()
+
+    async def _attempt(i, client, model_id):
+        if i > 0:
+            try:
+                await asyncio.wait_for(primary_failed.wait(), hedge_delay)
+            except asyncio.TimeoutError:
+                pass
+        try:
+            return i, await request(client, model_id)
+        except Exception:
+            if i == 0:
+                primary_failed.set()
+            raise
+
+    pending = {asyncio.create_task(_attempt(i, client, model_id)) for i, (_, client, model_id) in enumerate(sequence)}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return (*task.result(), primary_failed.is_set())
+    finally:
+        for task in pending:
+            task.cancel()
+    return None, None, True
+
+class ProviderSkipped(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+class Breaker:
+    """Per-provider circuit breaker: a failing provider is skipped for 1m -> 5m -> 25m -> 1h."""
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0
+
+    def check(self, provider):
+        if time.time() < self.open_until:
+            raise ProviderSkipped(f"{provider} is cooling down for {int(self.open_until - time.time())}s")
+
+    def record_success(self):
+        self.failures = 0
+        self.open_until = 0
+
+    def record_failure(self, exc):
+        self.failures += 1
+        if isinstance(exc, BILLING_ERRORS) or getattr(exc, "code", None) == "insufficient_quota":
+            cooldown = BILLING_COOLDOWN
         else:
-            img = Image.open(file)
-        
-        img.thumbnail((400, 400)) 
-        buf = io.BytesIO()
-        img.save(buf, format="JPEG")
-        base64_img = encode_image(buf.getvalue())
+            cooldown = min(60 * 5 ** (self.failures - 1), 3600)
+        self.open_until = time.time() + cooldown
+
+def _breaker(provider):
+    # Kept in session state so a tripped provider stays skipped across reruns
+    breakers = st.session_state.setdefault("breakers", {})
+    return breakers.setdefault(provider, Breaker())
+
+class ProviderLimiter:
+    """Rate limit for one provider: a semaphore caps requests in flight and a token bucket
+    keeps the estimated tokens per minute under budget, so batched calls don't turn into 429s."""
+    def __init__(self, concurrency, tpm):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tpm = tpm
+        self.tokens = tpm
+        self.updated = time.monotonic()
+
+    async def acquire_tokens(self, amount):
+        # A single request bigger than the whole budget just waits for a full bucket
+        amount = min(amount, self.tpm)
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.tpm, self.tokens + (now - self.updated) * self.tpm / 60)
+            self.updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) * 60 / self.tpm)
+
+def _limiter(provider):
+    # Per session, like the event loop the semaphore belongs to
+    limiters = st.session_state.setdefault("limiters", {})
+    if provider not in limiters:
+        limiters[provider] = ProviderLimiter(**PROVIDER_LIMITS.get(provider, DEFAULT_LIMITS))
+    return limiters[provider]
+
+def _estimate_tokens(messages, max_tokens=None):
+    """Rough request size: ~4 chars per token, ~1k per page image, plus the completion budget."""
+    tokens = max_tokens or 1000
+    for message in messages:
+        content = message["content"]
+        for part in [content] if isinstance(content, str) else content:
+            if isinstance(part, str):
+                tokens += len(part) // 4
+            elif part["type"] == "text":
+                tokens += len(part["text"]) // 4
+            else:
+                tokens += 1000
+    return tokens
+
+_backoff = wait_random_exponential(multiplier=2, max=20)
+
+def _wait_retry_after(retry_state):
+    """Sleeps for the provider's Retry-After on 429s, otherwise random exponential backoff."""
+    exc = retry_state.outcome.exception()
+    response = getattr(exc, "response", None)
+    try:
+        return min(float(response.headers["retry-after"]), 60)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return _backoff(retry_state)
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=_wait_retry_after,
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    reraise=True,
+)
+async def _create_with_retry(client, **kwargs):
+    limiter = _limiter(client.base_url.host)
+    await limiter.semaphore.acquire()
+    try:
+        await limiter.acquire_tokens(_estimate_tokens(kwargs["messages"], kwargs.get("max_tokens")))
+        response = await client.chat.completions.create(**kwargs)
+    except BaseException:
+        limiter.semaphore.release()
+        raise
+    if kwargs.get("stream"):
+        # A streamed body is still arriving after create() returns, so the slot is held until it is read
+        return _hold_slot(response, limiter.semaphore)
+    limiter.semaphore.release()
+    return response
+
+async def _hold_slot(stream, semaphore):
+    """Yields a streamed response's chunks, releasing its concurrency slot once drained or closed."""
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        try:
+            await stream.close()
+        finally:
+            semaphore.release()
+
+async def _create(client, **kwargs):
+    """Single chat completion call: skipped if the provider's breaker is open, rate limited per
+    provider, retried with backoff on transient errors, and (for outage/billing errors) recorded against
+    the breaker once retries run out."""
+    provider = client.base_url.host
+    breaker = _breaker(provider)
+    breaker.check(provider)
+    try:
+        response = await _create_with_retry(client, **kwargs)
+    except RETRYABLE_ERRORS + BILLING_ERRORS as e:
+        # Only outages and key/billing problems say the provider is unhealthy; a 400/404/413/422
+        # is about this one request or model and must not block the rest of the host's calls
+        breaker.record_failure(e)
+        raise
+    breaker.record_success()
+    return response
+
+def _delta(chunk):
+    return chunk.choices[0].delta.content if chunk.choices else None
+
+async def _open_stream(client, model_id, messages, **kwargs):
+    """Starts a streamed completion and waits for its first token, so providers can race on time-to-first-token.
+    Returns (first_token, remaining_chunks)."""
+    chunks = await _create(client, model=model_id, messages=messages, stream=True, **kwargs)
+    try:
+        async for chunk in chunks:
+            if _delta(chunk):
+                return _delta(chunk), chunks
+    except BaseException:
+        # Failed or lost the race: free the provider slot now rather than at garbage collection
+        await chunks.aclose()
+        raise
+    return "", chunks
+
+async def _drain_stream(first, chunks, on_text=None):
+    """Consumes the rest of a stream, passing the text so far to `on_text` after every token."""
+    text = first
+    try:
+        async for chunk in chunks:
+            if _delta(chunk):
+                text += _delta(chunk)
+                if on_text is not None:
+                    on_text(text)
+    finally:
+        await chunks.aclose()
+    return text
+
+def _live_code(placeholder):
+    """`on_text` callback that re-renders streamed text into a placeholder (None when there is none).
+    Renders are at least LIVE_RENDER_INTERVAL apart; pass `final=True` once the text is complete."""
+    if placeholder is None:
+        return None
+    last_render = 0.0
+
+    def render(text, final=False):
+        nonlocal last_render
+        now = time.monotonic()
+        if final or now - last_render >= LIVE_RENDER_INTERVAL:
+            last_render = now
+            placeholder.code(text, language="text", wrap_lines=True)
+    return render
+
+def _render_page(page, dpi=150):
+    zoom = dpi / 72
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+def _page_text(page):
+    """Selectable text of a page, block by block in reading order (top-to-bottom, left-to-right)."""
+    # Block tuples are (x0, y0, x1, y1, text, block_no, block_type); type 0 is text, 1 is an image
+    blocks = page.get_text("blocks", sort=True)
+    text = "\n".join(b[4].strip() for b in blocks if b[6] == 0 and b[4].strip())
+    # A stray header/page number on a scanned page isn't a real text layer
+    return text if len(text) >= PAGE_TEXT_MIN_CHARS else ""
+
+def _pdf_pages(path, dpi=150, first=None, last=None):
+    """Renders PDF pages in-process with PyMuPDF, yielding one PIL image at a time."""
+    with fitz.open(path, filetype="pdf") as doc:
+        for page in doc.pages(first or 0, last):
+            yield _render_page(page, dpi)
+
+def _first_page_image(upload, dpi=150):
+    """Returns page 1 as an RGB PIL image without decoding the rest of the document."""
+    if upload.is_pdf:
+        return next(_pdf_pages(upload.path, dpi=dpi, last=1))
+    # Decode fully so the file handle is closed before returning
+    with Image.open(upload.path) as img:
+        return img.convert("RGB")
+
+def _has_text_layer(upload):
+    """True for native PDFs whose first pages carry selectable text, i.e. not scanned."""
+    try:
+        with fitz.open(upload.path, filetype="pdf") as doc:
+            sample = "".join(_page_text(doc[i]) for i in range(min(3, len(doc))))
+        return len(sample) > TEXT_LAYER_MIN_CHARS
+    except Exception:
+        return False
+
+def _jpeg_b64(img, max_side, quality):
+    """Downscales to fit `max_side` and re-encodes as a compact JPEG, base64-encoded."""
+    img = img.convert("RGB")
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return encode_image(buf.getvalue())
+
+async def _page_b64(upload, max_side, quality, dpi=150):
+    """Page 1 as a compact base64 JPEG.
+    Memoized per upload so reruns don't re-render and re-encode the same page."""
+    key = (upload.digest, max_side, quality)
+    memo = st.session_state.setdefault("image_cache", {})
+    if key not in memo:
+        # Rendering and resize/JPEG/base64 are CPU-bound, so all of it runs off the event loop
+        # (_first_page_image opens its own document, so nothing is shared with the loop thread)
+        memo[key] = await asyncio.to_thread(lambda: _jpeg_b64(_first_page_image(upload, dpi=dpi), max_side, quality))
+    return memo[key]
+
+@cached(lambda upload: (upload.digest,))
+async def get_routing_decision(upload):
+    """AI Router: Analyzes visual complexity with automated GPT -> Groq fallback."""
+    try:
+        # Image Preparation (50 dpi renders an A4 page at ~585px, so the pixmap is born small)
+        base64_img = await _page_b64(upload, max_side=512, quality=70, dpi=50)
         
         prompt = "Look at this document. Is it a clean printed form (OCR) or is it handwritten/complex/messy (VISION)? Reply with ONLY the word OCR or VISION."
         
         # --- PRIMARY: GPT-4o-mini ---
         try:
-            response = openai_client.chat.completions.create(
+            response = await _create(
+                openai_client,
                 model="gpt-4o-mini",
                 messages=[{"role": "user", "content": [
                     {"type": "text", "text": prompt},
@@ -90,7 +549,8 @@ def get_routing_decision(file):
         except Exception as e:
             # --- FALLBACK: Groq Llama Vision ---
             st.toast(f"⚠️ GPT failover: Switching to Groq", icon="🔄")
-            response = groq_client.chat.completions.create(
+            response = await _create(
+                groq_client,
                 model="meta-llama/llama-4-scout-17b-16e-instruct",
                 messages=[{"role": "user", "content": [
                     {"type": "text", "text": prompt},
@@ -101,111 +561,211 @@ def get_routing_decision(file):
             return response.choices[0].message.content.strip().upper()
             
     except Exception:
-        return "OCR"
+        raise FailedResult("OCR")
 
-def extract_text_standard(file):
-    """Local Tesseract extraction (No API needed, but kept for structure)."""
-    text = ""
+@cached(lambda upload, preview=None: (upload.digest,))
+async def extract_text_standard(upload, preview=None):
+    """Local Tesseract extraction (No API needed, but kept for structure).
+    PDF pages with a text layer are read directly; only image-only pages are OCR'd.
+    If a `preview` future is given, it is resolved as soon as enough text exists to categorize."""
     try:
-        if file.type == "application/pdf":
-            images = convert_from_bytes(file.getvalue())
-            for img in images:
-                text += pytesseract.image_to_string(img, lang="hin+eng") + "\n"
+        if upload.is_pdf:
+            loop = asyncio.get_running_loop()
+            pending = deque()
+            # Collected per page and joined once, rather than re-copying the whole text on every page
+            parts = []
+            chars = 0
+
+            async def _collect():
+                nonlocal chars
+                parts.append(await pending.popleft())
+                chars += len(parts[-1])
+                if preview is not None and not preview.done() and chars >= CATEGORY_SAMPLE_CHARS:
+                    preview.set_result("\n".join(parts))
+
+            # Pages are OCR'd in parallel across processes, but joined back in page order
+            try:
+                with fitz.open(upload.path, filetype="pdf") as doc:
+                    for page in doc:
+                        page_text = _page_text(page)
+                        if page_text:
+                            pending.append(loop.create_future())
+                            pending[-1].set_result(page_text)
+                            continue
+                        img = _render_page(page)
+                        # Ship raw RGB bytes instead of pickling PIL images
+                        pending.append(loop.run_in_executor(_ocr_pool(), ocr_page, (img.size, img.tobytes())))
+                        # Cap rendered pages in flight so big PDFs don't pile up in memory
+                        if len(pending) >= OCR_WORKERS * 2:
+                            await _collect()
+                while pending:
+                    await _collect()
+            finally:
+                # After a failure nobody reads the remaining pages: stop their OCR, and retrieve
+                # errors of already-finished ones so they aren't logged as never retrieved
+                for future in pending:
+                    if not future.cancel() and not future.cancelled():
+                        future.exception()
+            text = "\n".join(parts)
         else:
-            image = Image.open(file)
-            text = pytesseract.image_to_string(image, lang="hin+eng")
+            # Also via the pool: each worker owns a preloaded Tesseract engine
+            image = _first_page_image(upload)
+            text = await asyncio.get_running_loop().run_in_executor(_ocr_pool(), ocr_page, (image.size, image.tobytes()))
         return text
+    except BrokenProcessPool:
+        # A worker died (crash/OOM) and the pool is unusable: drop it so the next request builds a fresh one
+        _ocr_pool.clear()
+        raise FailedResult("OCR Error: an OCR worker crashed. Please retry.")
     except Exception as e:
-        return f"OCR Error: {str(e)}"
+        raise FailedResult(f"OCR Error: {str(e)}")
+
+def _vision_batches(images, caps):
+    """Splits base64 images into consecutive runs that fit one request of a model with these caps."""
+    batches, size = [], 0
+    for b64 in images:
+        if not batches or len(batches[-1]) >= caps.max_images or size + len(b64) > caps.max_payload:
+            batches.append([])
+            size = 0
+        batches[-1].append(b64)
+        size += len(b64)
+    return batches
+
+async def _transcribe_request(images, client, model_id, on_text=None):
+    """One streamed multi-image vision request; returns the raw transcription."""
+    prompt = "Transcribe all text from this image perfectly. Match language script (Hindi/English). Fix handwriting errors."
+    if len(images) > 1:
+        prompt += f" The images are consecutive pages: return each page's text separated by a line containing only {PAGE_DELIMITER}."
+    messages = [{"role": "user", "content": [
+        {"type": "text", "text": prompt},
+        *[{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}} for b64 in images]
+    ]}]
+    first, chunks = await _open_stream(client, model_id, messages)
+    return await _drain_stream(first, chunks, on_text)
+
+async def _transcribe_batch(images, sequence, on_text=None):
+    """Transcribes consecutive pages with automated Provider -> Alternate fallback, splitting them
+    into as many requests as each model's caps require.
+    Returns (index of the provider that answered, one text per image), or (None, None) if every provider failed."""
+    # Loop through sequence until one transcribes every page
+    for i, (name, client, model_id, caps) in enumerate(sequence):
+        page_texts = []
 
-def extract_text_vision(file, provider):
-    """Image transcription with automated Provider -> Alternate fallback."""
+        def _show(text):
+            on_text("\n".join(page_texts + [text]))
+
+        show = _show if on_text else None
+        try:
+            for part in _vision_batches(images, caps):
+                text = await _transcribe_request(part, client, model_id, show)
+                part_texts = [t.strip() for t in text.split(PAGE_DELIMITER)]
+                if len(part_texts) == len(part):
+                    page_texts.extend(part_texts)
+                elif len(part) == 1:
+                    page_texts.append(text.replace(PAGE_DELIMITER, "\n").strip())
+                else:
+                    # Page breaks weren't kept: redo these pages one per request rather than misplace their text
+                    st.toast(f"⚠️ {name} merged {len(part)} pages. Transcribing them one at a time...", icon="📄")
+                    for b64 in part:
+                        text = await _transcribe_request([b64], client, model_id, show)
+                        page_texts.append(text.replace(PAGE_DELIMITER, "\n").strip())
+            return i, page_texts
+        except Exception:
+            st.toast(f"🚨 {name} transcription failed. Trying fallback...", icon="🔄")
+            continue # Move to next model in sequence
+    return None, None
+
+@cached(lambda upload, provider, placeholder=None: (upload.digest, provider))
+async def extract_text_vision(upload, provider, placeholder=None):
+    """Image transcription with automated Provider -> Alternate fallback.
+    PDF pages with a text layer are read directly; image-only pages are sent in batches sized to the
+    primary model's caps, with the batches running concurrently."""
     try:
-        if file.type == "application/pdf":
-            images = convert_from_bytes(file.getvalue())
-            img = images[0]
-            buf = io.BytesIO()
-            img.save(buf, format="JPEG")
-            img_bytes = buf.getvalue()
+        # pages[i] is the page's text, or None until it has been transcribed
+        if upload.is_pdf:
+            pages, images = [], []
+            with fitz.open(upload.path, filetype="pdf") as doc:
+                for page in doc:
+                    page_text = _page_text(page)
+                    pages.append(page_text or None)
+                    if not page_text:
+                        # Vision models cap the long edge at 2048px, so anything bigger is wasted upload.
+                        # Rasterizing stays on this thread, which owns the open document; only the
+                        # resize/JPEG/base64 step is moved off the event loop
+                        b64 = await asyncio.to_thread(_jpeg_b64, _render_page(page), 2048, 85)
+                        images.append((len(pages) - 1, b64))
         else:
-            img_bytes = file.getvalue()
+            pages, images = [None], [(0, await _page_b64(upload, max_side=2048, quality=85))]
 
-        base64_img = encode_image(img_bytes)
-        prompt = "Transcribe all text from this image perfectly. Match language script (Hindi/English). Fix handwriting errors."
+        sequence = VISION_SEQUENCES[provider]
 
-        # Define sequence: [Primary, Fallback]
-        if provider == "GPT-4o":
-            sequence = [
-                ("GPT-4o", openai_client, "gpt-4o"),
-                ("Groq", groq_client, "meta-llama/llama-4-scout-17b-16e-instruct")
-            ]
-        else:
-            sequence = [
-                ("Groq", groq_client, "meta-llama/llama-4-scout-17b-16e-instruct"),
-                ("GPT-4o", openai_client, "gpt-4o")
-            ]
+        page_nos = [page_no for page_no, _ in images]
+        batches = _vision_batches([b64 for _, b64 in images], sequence[0][3])
+        # Live view: every batch streams into its own slot, shown in page order
+        live = [""] * len(batches)
+        render = _live_code(placeholder)
 
-        # Loop through sequence until one works
-        for name, client, model_id in sequence:
-            try:
-                response = client.chat.completions.create(
-                    model=model_id,
-                    messages=[{"role": "user", "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}}
-                    ]}]
-                )
-                return response.choices[0].message.content
-            except Exception as e:
-                st.toast(f"🚨 {name} transcription failed. Trying fallback...", icon="🔄")
-                continue # Move to next model in sequence
-        
-        return "❌ All transcription providers failed."
+        def _on_text(i):
+            def _update(text):
+                live[i] = text.replace(PAGE_DELIMITER, "")
+                render("\n".join(live))
+            return _update if render else None
+
+        results = await asyncio.gather(*[
+            _transcribe_batch(batch, sequence, _on_text(i))
+            for i, batch in enumerate(batches)
+        ])
+        if render:
+            render("\n".join(live), final=True)
+        if any(answered_by is None for answered_by, _ in results):
+            raise FailedResult("❌ All transcription providers failed.")
+        page_texts = [page_text for _, result in results for page_text in result]
+        for page_no, page_text in zip(page_nos, page_texts):
+            pages[page_no] = page_text
+        if any(answered_by > 0 for answered_by, _ in results):
+            raise FallbackResult("\n".join(pages))
+        return "\n".join(pages)
         
+    except FailedResult:
+        raise
     except Exception as e:
-        return f"Logic Error: {str(e)}"
+        raise FailedResult(f"Logic Error: {str(e)}")
     
-def categorize_document(text, primary):
+@cached(lambda text, primary: (_sha256(text), primary))
+async def categorize_document(text, primary):
     """AI identifies document category with automated GPT -> Groq fallback."""
     # Safety check for empty text
     if not text or len(text.strip()) < 5:
         return "Document"
 
-    prompt = f"Categorize this document (e.g., Invoice, Resume, Legal, Report). Return ONLY the 1-2 word name.\n\nText: {text[:1000]}"
+    prompt = f"Categorize this document (e.g., Invoice, Resume, Legal, Report). Return ONLY the 1-2 word name.\n\nText: {text[:CATEGORY_SAMPLE_CHARS]}"
     
-    # Define the sequence: (Name, Client, Model)
-    if primary == "GPT-4o":
-        sequence = [
-            ("GPT-4o", openai_client, "gpt-4o-mini"),
-            ("Groq", groq_client, "llama-3.1-8b-instant")
-        ]
-    else:
-        sequence = [
-            ("Groq", groq_client, "llama-3.1-8b-instant"),
-            ("GPT-4o", openai_client, "gpt-4o-mini")
-        ]
+    sequence = CATEGORY_SEQUENCES[primary]
 
     for i, (name, client, model_id) in enumerate(sequence):
         try:
-            response = client.chat.completions.create(
+            response = await _create(
+                client,
                 model=model_id, 
                 messages=[{"role": "user", "content": prompt}], 
                 max_tokens=10
             )
-            return response.choices[0].message.content.strip().replace(" ", "_")
-        
         except Exception:
             # If the first attempt fails, trigger the UI warning flag
             if i == 0:
                 st.session_state.failover_active = True
             continue # Move to the fallback model
+        category = response.choices[0].message.content.strip().replace(" ", "_")
+        if i > 0:
+            raise FallbackResult(category)
+        return category
 
-    return "Document"
+    raise FailedResult("Document")
 
 if "failover_active" not in st.session_state:
     st.session_state.failover_active = False
 
-def summarize_text(text, summary_type, primary, language):
+@cached(lambda text, summary_type, primary, language, placeholder=None: (_sha256(text), summary_type, language, primary))
+async def summarize_text(text, summary_type, primary, language, placeholder=None):
     prompt_map = {
         "Short Summary": "Summarize briefly in 3-5 sentences.",
         "Detailed Summary": "Provide a comprehensive and detailed summary.",
@@ -214,71 +774,97 @@ def summarize_text(text, summary_type, primary, language):
     instruction = prompt_map.get(summary_type, summary_type)
     prompt = f"Process this doc in {language}. Instruction: {instruction}\n\nContent: {text}"
     
-    # Define sequence
-    if primary == "GPT-4o":
-        sequence = [
-            ("GPT-4o", openai_client, "gpt-4o"),
-            ("Groq", groq_client, "llama-3.3-70b-versatile")
-        ]
+    sequence = SUMMARY_SEQUENCES[primary]
+
+    messages = [{"role": "user", "content": prompt}]
+
+    # Race primary against a hedged fallback on time-to-first-token; the winner keeps streaming
+    winner, opened, primary_failed = await _race_providers(sequence, lambda client, model_id: _open_stream(client, model_id, messages))
+    if winner is None:
+        raise FailedResult("❌ All AI providers failed. Check API balance.")
+    if primary_failed:
+        # The FIRST model actually errored (not merely slower than the hedge), trigger the warning state
+        st.session_state.failover_active = True
+    render = _live_code(placeholder)
+    try:
+        summary = await _drain_stream(*opened, render)
+    except Exception:
+        raise FailedResult("❌ Connection dropped mid-response. Please retry.")
+    if render:
+        render(summary, final=True)
+    if not summary.strip():
+        raise FailedResult("❌ The model returned an empty response. Please retry.")
+    if winner > 0:
+        raise FallbackResult(summary)
+    return summary
+
+async def process_document(upload, provider, auto, manual_mode, placeholder=None):
+    """Route -> extract -> categorize, with categorization starting as soon as a text preview exists."""
+    # --- The Automatic Logic Part ---
+    if auto and upload.is_pdf and _has_text_layer(upload):
+        # Native PDFs already carry their text: no router call, and only image-only pages get OCR'd
+        mode = "OCR"
+        st.toast("Embedded text found: skipping AI Router", icon="⚡")
+    elif auto:
+        mode = await get_routing_decision(upload)
+        st.toast(f"AI Router selected: {mode} mode", icon="🤖")
     else:
-        sequence = [
-            ("Groq", groq_client, "llama-3.3-70b-versatile"),
-            ("GPT-4o", openai_client, "gpt-4o")
-        ]
+        # Manual Fallback
+        mode = "VISION" if "AI Vision" in manual_mode else "OCR"
 
-    for i, (name, client, model_id) in enumerate(sequence):
-        try:
-            response = client.chat.completions.create(
-                model=model_id, 
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return response.choices[0].message.content
-        except Exception:
-            # If the FIRST model fails, trigger the warning state
-            if i == 0:
-                st.session_state.failover_active = True
-            continue 
+    preview = asyncio.get_running_loop().create_future()
+
+    async def _extract():
+        if mode == "VISION":
+            text = await extract_text_vision(upload, provider, placeholder)
+        else:
+            text = await extract_text_standard(upload, preview)
+        if not preview.done():
+            preview.set_result(text)
+        return text
+
+    async def _categorize():
+        return await categorize_document(await preview, provider)
+
+    # Categorize runs alongside the remaining pages of extraction
+    return await asyncio.gather(_extract(), _categorize())
 
-    return "❌ All AI providers failed. Check API balance."
+@st.cache_resource
+def _pdf_styles():
+    return getSampleStyleSheet()
 
+@st.cache_data(max_entries=20)
 def generate_pdf(summary_text):
+    """Builds the report PDF once per result; Streamlit reruns reuse the cached bytes."""
     buffer = io.BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4)
-    styles = getSampleStyleSheet()
+    styles = _pdf_styles()
     story = [Paragraph("<b>Uchiha AI – Intelligence Report</b>", styles["Title"]), Paragraph("<br/>", styles["Normal"])]
-    for line in summary_text.split("\n"):
-        if line.strip():
-            clean_line = line.replace('&','&amp;').replace('<','&lt;').replace('>','&gt;')
-            story.append(Paragraph(clean_line, styles["Normal"]))
+    if len(summary_text) > LARGE_REPORT_CHARS:
+        story.append(Preformatted(summary_text, styles["Code"], maxLineLength=90))
+    else:
+        # One Paragraph per block of lines instead of one per line (each Paragraph is an XML parse)
+        for block in summary_text.split("\n\n"):
+            lines = [html.escape(line, quote=False) for line in block.split("\n") if line.strip()]
+            if lines:
+                story.append(Paragraph("<br/>".join(lines), styles["Normal"]))
     doc.build(story)
-    buffer.seek(0)
-    return buffer
+    return buffer.getvalue()
 
 # ===== App Logic =====
 if uploaded_file:
     if st.button("🚀 Process Document"):
+        stream_box = st.empty()
         with st.spinner("Analyzing and Scanning..."):
             st.session_state.summary_result = None
-            
-            # --- The Automatic Logic Part ---
-            if use_auto:
-                decision = get_routing_decision(uploaded_file)
-                st.toast(f"AI Router selected: {decision} mode", icon="🤖")
-                if decision == "VISION":
-                    st.session_state.extracted_text = extract_text_vision(uploaded_file, primary_provider)
-                else:
-                    st.session_state.extracted_text = extract_text_standard(uploaded_file)
-            else:
-                # Manual Fallback
-                if "AI Vision" in scanning_mode:
-                    st.session_state.extracted_text = extract_text_vision(uploaded_file, primary_provider)
-                else:
-                    st.session_state.extracted_text = extract_text_standard(uploaded_file)
+            st.session_state.extracted_text, st.session_state.doc_category = _run_async(
+                process_document(_read_upload(uploaded_file), primary_provider, use_auto, scanning_mode, stream_box)
+            )
 
-            # Categorization logic
+            # Categorization result
             if st.session_state.extracted_text:
-                st.session_state.doc_category = categorize_document(st.session_state.extracted_text, primary_provider)
                 st.toast(f"📂 Detected as: {st.session_state.doc_category}", icon="📁")
+        stream_box.empty()
     
     if st.session_state.extracted_text:
         st.subheader(f"📜 Extracted Text ({st.session_state.doc_category})")
@@ -289,21 +875,28 @@ if uploaded_file:
             options = ["Short Summary", "Detailed Summary", "Bullet Points", "✨ Customized Prompt (Chat)"]
             summary_type = st.selectbox("Select Output Style", options)
         
+        # (instruction, spinner text) of the request to run, if a button was pressed
+        pending_request = None
         with col2:
             if "Customized Prompt" not in summary_type:
                 if st.button("✨ Summarize Now"):
-                    st.session_state.failover_active = False
-                    with st.spinner(f"Processing in {target_language}..."):
-                        st.session_state.summary_result = summarize_text(st.session_state.extracted_text, summary_type, primary_provider, target_language)
+                    pending_request = (summary_type, f"Processing in {target_language}...")
 
         if "Customized Prompt" in summary_type:
             st.markdown("---")
             user_input = st.text_input("💬 Chat with Document:", placeholder="e.g. 'Extract key dates' or 'Make a table'")
             if st.button("🚀 Send Instructions"):
                 if user_input:
-                    st.session_state.failover_active = False
-                    with st.spinner("AI is thinking..."):
-                        st.session_state.summary_result = summarize_text(st.session_state.extracted_text, user_input, primary_provider, target_language)
+                    pending_request = (user_input, "AI is thinking...")
+
+        if pending_request:
+            instruction, spinner_text = pending_request
+            st.session_state.failover_active = False
+            # Full-width box the tokens stream into; replaced by the result section once done
+            stream_box = st.empty()
+            with st.spinner(spinner_text):
+                st.session_state.summary_result = _run_async(summarize_text(st.session_state.extracted_text, instruction, primary_provider, target_language, stream_box))
+            stream_box.empty()
 
         if st.session_state.failover_active:
             st.warning("⚠️ Primary Model failed. Switching to Failover Engine...", icon="🔄")
@@ -314,4 +907,7 @@ if uploaded_file:
         
         pdf = generate_pdf(st.session_state.summary_result)
         final_filename = f"{st.session_state.doc_category}_Summary.pdf"
-        st.download_button("📥 Download PDF", data=pdf, file_name=final_filename, mime="application/pdf")
\ No newline at end of file
+        st.download_button("📥 Download PDF", data=pdf, file_name=final_filename, mime="application/pdf")
+else:
+    # Uploader cleared: the spooled copy is no longer needed
+    _discard_upload()
\ No newline at end of file
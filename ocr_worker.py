@@ -0,0 +1,72 @@
+import multiprocessing
+import sys
+import pytesseract
+from PIL import Image
+
+try:
+    from tesserocr import PyTessBaseAPI, OEM, PSM
+except ImportError:  # no libtesseract bindings: fall back to the CLI (one subprocess per page)
+    PyTessBaseAPI = None
+
+# Lives outside app.py so the process pool can pickle it by reference
+# (Streamlit executes app.py as a throwaway __main__ module, which the workers skip).
+
+# dev purposes (set here: OCR runs in these worker processes, not in app.py)
+# pytesseract.pytesseract.tesseract_cmd = "/opt/homebrew/bin/tesseract"
+
+TESSERACT_LANG = "hin+eng"
+# LSTM-only engine (the legacy engine is slow for Hindi) and PSM 6 = one uniform block of text,
+# which suits printed forms. Use --psm 4 for column layouts or --psm 11 for sparse text.
+TESSERACT_CONFIG = "--oem 1 --psm 6"
+
+class WorkerProcess(multiprocessing.context.SpawnProcess):
+    """Spawned OCR worker that doesn't re-run the Streamlit script.
+    Streamlit runs app.py as a fake __main__ with __file__ set, which spawn would otherwise replay in
+    every worker (Streamlit, the API clients and all), so __file__ is hidden while the worker starts."""
+    def start(self):
+        main = sys.modules["__main__"]
+        main_file = main.__dict__.pop("__file__", None)
+        try:
+            super().start()
+        finally:
+            if main_file is not None:
+                main.__file__ = main_file
+
+class WorkerContext(multiprocessing.context.SpawnContext):
+    Process = WorkerProcess
+
+# One engine per worker process (the API is not thread-safe), so the ~30MB of
+# hin+eng traineddata is loaded once instead of on every page.
+# None = not loaded yet, False = unavailable (pytesseract is used instead)
+_api = None
+
+def preload():
+    """Process-pool initializer: loads the Tesseract engine before the first page arrives.
+    Never raises: an initializer error would break the whole pool."""
+    global _api
+    if _api is not None:
+        return
+    if PyTessBaseAPI is None:
+        _api = False
+        return
+    try:
+        _api = PyTessBaseAPI(lang=TESSERACT_LANG, oem=OEM.LSTM_ONLY, psm=PSM.SINGLE_BLOCK)
+    except Exception:  # e.g. missing traineddata or a tessdata path mismatch
+        _api = False
+
+def ocr_image(img):
+    preload()
+    if not _api:
+        return pytesseract.image_to_string(img, lang=TESSERACT_LANG, config=TESSERACT_CONFIG)
+    _api.SetImage(img)
+    return _api.GetUTF8Text()
+
+def ocr_page(page):
+    """Process-pool worker: rebuilds a page from raw RGB bytes and runs Tesseract on it."""
+    size, data = page
+    try:
+        return ocr_image(Image.frombytes("RGB", size, data))
+    except Exception as e:
+        # Errors are pickled back to app.py, and some (e.g. TesseractNotFoundError) can't be
+        # rebuilt there, which would mark the whole pool as broken; ship the message instead
+        raise RuntimeError(str(e)) from None